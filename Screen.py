@@ -1,12 +1,28 @@
 from __future__ import annotations
+import copy
+import os
+import sys
+import threading
 import typing
 import cv2
 import win32con
 import win32gui
-from numpy import array
+from numpy import array, asarray, frombuffer, int32, uint8
 import mss
 import json
 
+# Set to True to include layered (transparent) windows in mss captures. This costs an extra composition
+# pass in BitBlt and would also capture EDAP's own debug overlay, which is a layered window.
+CAPTURE_LAYERED_WINDOWS = False
+if sys.platform == 'win32' and not CAPTURE_LAYERED_WINDOWS:
+    import mss.windows
+    mss.windows.CAPTUREBLT = 0
+
+try:
+    import dxcam  # Optional, DXGI Desktop Duplication capture on Windows
+except ImportError:
+    dxcam = None
+
 from EDlogger import logger
 
 
@@ -26,66 +42,160 @@ Author: sumzer0@yahoo.com
 #     img = ImageGrab.grab(bbox)
 
 elite_dangerous_window = "Elite - Dangerous (CLIENT)"
+_cached_ed_hwnd = 0  # Cached ED window handle, see get_elite_window_handle()
+
+
+def get_elite_window_handle() -> int:
+    """ Gets the ED window handle, or 0 if ED is not running. The handle is cached and only looked up again
+    with FindWindow when the cached window no longer exists or has a different title. """
+    global _cached_ed_hwnd
+    hwnd = _cached_ed_hwnd
+    if hwnd and win32gui.IsWindow(hwnd) and win32gui.GetWindowText(hwnd) == elite_dangerous_window:
+        return hwnd
+
+    hwnd = win32gui.FindWindow(None, elite_dangerous_window)
+    _cached_ed_hwnd = hwnd
+    return hwnd
 
 
 def set_focus_elite_window():
     """ set focus to the ED window, if ED does not have focus then the keystrokes will go to the window
     that does have focus. """
-    ed_title = "Elite - Dangerous (CLIENT)"
+    global _cached_ed_hwnd
 
     # TODO - determine if GetWindowText is faster than FindWindow if ED is in foreground
-    if win32gui.GetWindowText(win32gui.GetForegroundWindow()) == ed_title:
+    if win32gui.GetWindowText(win32gui.GetForegroundWindow()) == elite_dangerous_window:
         return
 
-    handle = win32gui.FindWindow(0, ed_title)
+    handle = get_elite_window_handle()
     if handle != 0:
         try:
             win32gui.ShowWindow(handle, win32con.SW_NORMAL)  # give focus to ED
             win32gui.SetForegroundWindow(handle)  # give focus to ED
         except:
+            _cached_ed_hwnd = 0
             print("set_focus_elite_window ERROR")
             pass
 
 
+def bgra_to_rgb(image):
+    """ Converts a BGRA screen grab to a 3 channel RGB image in a single pass. """
+    return cv2.cvtColor(image, cv2.COLOR_BGRA2RGB)
+
+
+def bgra_to_bgr(image):
+    """ Converts a BGRA screen grab to a 3 channel BGR image by dropping the alpha channel. """
+    return cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+
+
+_dxcam_last_frames = {}  # (device_idx, output_idx): last frame, shared as dxcam has one camera per output
+_dxcam_lock = threading.Lock()  # dxcam cameras are single-producer and shared by every Screen on an output
+# The factory dxcam builds at import. Calling DXFactory() again prints a warning as it is a singleton.
+_dxcam_factory = getattr(dxcam, '__factory', None) if dxcam is not None else None
+
+
+def find_dxcam_output(mon) -> typing.Tuple[int, int] | None:
+    """ Finds the dxcam (DXGI) output whose desktop coordinates match the mss monitor. The DXGI output order
+    is not guaranteed to match the mss monitor order, and outputs may be on another adapter.
+    Returns (device_idx, output_idx) or None.
+    """
+    if _dxcam_factory is None:
+        return None
+    for device_idx, outputs in enumerate(_dxcam_factory.outputs):
+        for output_idx, output in enumerate(outputs):
+            rect = output.desc.DesktopCoordinates
+            if (rect.left, rect.top, rect.right - rect.left, rect.bottom - rect.top) == \
+                    (mon['left'], mon['top'], mon['width'], mon['height']):
+                return device_idx, output_idx
+    return None
+
+
+class DXCamBackend:
+    """ Screen capture using DXGI Desktop Duplication (dxcam). The frame is kept in BGRA format so that it
+    is interchangeable with an mss grab. """
+    def __init__(self, device_idx: int, output_idx: int):
+        self._key = (device_idx, output_idx)
+        self._camera = dxcam.create(device_idx=device_idx, output_idx=output_idx, output_color="BGRA")
+
+    def grab(self, x_left, y_top, x_right, y_bot):
+        """ Grabs the region (in pixels relative to the output) and returns it as a BGRA image, or None
+        if no frame has been captured yet. dxcam returns None when the desktop has not changed since the
+        previous grab, in which case the last frame is still current and is reused instead of blocking.
+        The last frame is kept per output rather than per backend, as dxcam returns the same camera to
+        every Screen and any of them may have taken the new frame.
+        """
+        with _dxcam_lock:
+            frame = self._camera.grab()
+            if frame is None:
+                frame = _dxcam_last_frames.get(self._key)
+            else:
+                _dxcam_last_frames[self._key] = frame
+
+        if frame is None:
+            return None
+        # The last frame is shared between grabs and read-only, so return a copy of only the region
+        return frame[y_top:y_bot, x_left:x_right].copy()
+
+
 class Screen:
+    _config_cache: dict[str, tuple[float, dict]] = {}  # fileName: (mtime, config), see read_config()
+
     def __init__(self, cb):
         self.ap_ckb = cb
-        self.mss = mss.mss()
+        self._mss = None  # Created on the first grab, see the mss property
+        self._capture_lock = threading.Lock()  # guards the reused mss region dict, see _update_grab_origin()
+        self._dxcam = None  # DXGI capture backend, used in preference to mss when available
         self.using_screen = True  # True to use screen, false to use an image. Set screen_image to the image
         self._screen_image = None  # Screen image captured from screen, or loaded by user for testing.
 
+        # Examine all monitors to determine match with ED
+        # ignore monitor 0 as it is the complete desktop (dims of all monitors)
+        # mss.mss() also makes the process per-monitor DPI aware, so this must run before
+        # GetWindowRect below or the window rect is in scaled (virtualised) coordinates
+        self.mons = self._enumerate_monitors()
+
         # Find ED window position to determine which monitor it is on
         ed_rect = self.get_elite_window_rect()
         if ed_rect is None:
             self.ap_ckb('log', f"ERROR: Could not find window {elite_dangerous_window}.")
             logger.error(f'Could not find window {elite_dangerous_window}.')
         else:
-            logger.debug(f'Found Elite Dangerous window position: {ed_rect}')
+            logger.debug('Found Elite Dangerous window position: %s', ed_rect)
 
-        # Examine all monitors to determine match with ED
-        self.mons = self.mss.monitors
-        mon_num = 0
-        for item in self.mons:
-            if mon_num > 0:  # ignore monitor 0 as it is the complete desktop (dims of all monitors)
-                logger.debug(f'Found monitor {mon_num} with details: {item}')
-                if ed_rect is None:
-                    self.monitor_number = mon_num
-                    self.mon = self.mss.monitors[self.monitor_number]
-                    logger.debug(f'Defaulting to monitor {mon_num}.')
-                    self.screen_width = item['width']
-                    self.screen_height = item['height']
-                    break
+        monitors_by_origin = {(item['left'], item['top']): mon_num
+                              for mon_num, item in enumerate(self.mons) if mon_num > 0}
+        logger.debug('Found monitors: %s', self.mons[1:])
+        if ed_rect is None:
+            self.monitor_number = 1
+            logger.debug('Defaulting to monitor %d.', self.monitor_number)
+        elif (ed_rect[0], ed_rect[1]) in monitors_by_origin:
+            self.monitor_number = monitors_by_origin[(ed_rect[0], ed_rect[1])]
+            logger.debug('Elite Dangerous is on monitor %d.', self.monitor_number)
+        else:
+            # ED is windowed, or its position does not line up with any monitor
+            self.monitor_number = 1
+            logger.warning('Elite Dangerous window %s does not match the origin of any monitor, '
+                           'defaulting to monitor %d.', ed_rect, self.monitor_number)
+
+        self.mon = self.mons[self.monitor_number]
+        self.screen_width = self.mon['width']
+        self.screen_height = self.mon['height']
+        self._update_rect_scale()
+
+        self._update_grab_origin()
+
+        # Use DXGI Desktop Duplication on Windows if dxcam is installed, mss is used as the fallback
+        if dxcam is not None and sys.platform == 'win32':
+            try:
+                dxcam_output = find_dxcam_output(self.mon)
+                if dxcam_output is None:
+                    logger.warning('No dxcam output matches monitor %d, falling back to mss.', self.monitor_number)
                 else:
-                    if item['left'] == ed_rect[0] and item['top'] == ed_rect[1]:
-                        # Get information of monitor 2
-                        self.monitor_number = mon_num
-                        self.mon = self.mss.monitors[self.monitor_number]
-                        logger.debug(f'Elite Dangerous is on monitor {mon_num}.')
-                        self.screen_width = item['width']
-                        self.screen_height = item['height']
-
-            # Next monitor
-            mon_num = mon_num + 1
+                    self._dxcam = DXCamBackend(*dxcam_output)
+                    logger.debug('Using dxcam for screen capture on device %d, output %d.', *dxcam_output)
+            except Exception as e:
+                logger.warning('Could not start dxcam, falling back to mss: %s', e)
+                self._dxcam = None
 
         # Add new screen resolutions here with tested scale factors
         # this table will be default, overwritten when loading resolution.json file
@@ -112,7 +222,7 @@ class Screen:
         # if we read it then point to it, otherwise use the default table above
         if ss is not None:
             self.scales = ss
-            logger.debug("read json:"+str(ss))
+            logger.debug("read json: %s", ss)
 
         # try to find the resolution/scale values in table
         # if not, then take current screen size and divide it out by 3440 x1440
@@ -131,15 +241,30 @@ class Screen:
         # if self.scales['Calibrated'][1] != -1.0:
         #     self.scaleY = self.scales['Calibrated'][1]
         
-        logger.debug('screen size: '+str(self.screen_width)+" "+str(self.screen_height))
-        logger.debug('Default scale X, Y: '+str(self.scaleX)+", "+str(self.scaleY))
+        logger.debug('screen size: %d %d', self.screen_width, self.screen_height)
+        logger.debug('Default scale X, Y: %s, %s', self.scaleX, self.scaleY)
+
+    @property
+    def mss(self):
+        """ The mss instance used for grabs. Created on first use, so a Screen that only works on images
+        set with set_screen_image() never creates one.
+        """
+        if self._mss is None:
+            self._mss = mss.mss()
+        return self._mss
+
+    @staticmethod
+    def _enumerate_monitors() -> list:
+        """ Returns the mss monitor list. Monitor 0 is the complete desktop (dims of all monitors). """
+        with mss.mss() as sct:
+            return list(sct.monitors)
 
     @staticmethod
     def get_elite_window_rect() -> typing.Tuple[int, int, int, int] | None:
         """ Gets the ED window rectangle.
         Returns (left, top, right, bottom) or None.
         """
-        hwnd = win32gui.FindWindow(None, elite_dangerous_window)
+        hwnd = get_elite_window_handle()
         if hwnd:
             rect = win32gui.GetWindowRect(hwnd)
             return rect
@@ -150,12 +275,20 @@ class Screen:
     def elite_window_exists() -> bool:
         """ Does the ED Client Window exist (i.e. is ED running)
         """
-        hwnd = win32gui.FindWindow(None, elite_dangerous_window)
+        hwnd = get_elite_window_handle()
         if hwnd:
             return True
         else:
             return False
 
+    def _update_grab_origin(self):
+        """ Caches the origin of the selected monitor and the region dict passed to mss, which is updated
+        in place on each grab rather than rebuilt. Call again if the selected monitor changes.
+        """
+        self._mon_top = self.mon["top"]
+        self._mon_left = self.mon["left"]
+        self._grab_region = {"top": 0, "left": 0, "width": 0, "height": 0, "mon": self.monitor_number}
+
     def write_config(self, data, fileName='./configs/resolution.json'):
         if data is None:
             data = self.scales
@@ -164,12 +297,23 @@ class Screen:
                 json.dump(data,fp, indent=4)
         except Exception as e:
             logger.warning("Screen.py write_config error:"+str(e))
+        Screen._config_cache.pop(fileName, None)
 
-    def read_config(self, fileName='./configs/resolution.json'):
+    @classmethod
+    def read_config(cls, fileName='./configs/resolution.json'):
+        """ Reads the resolution config. The parsed file is cached per process and only read again
+        if the file modification time changes. Each caller gets its own copy of the config.
+        """
         s = None
         try:
+            mtime = os.stat(fileName).st_mtime
+            cached = cls._config_cache.get(fileName)
+            if cached is not None and cached[0] == mtime:
+                return copy.deepcopy(cached[1])
+
             with open(fileName,"r") as fp:
                 s = json.load(fp)
+            cls._config_cache[fileName] = (mtime, copy.deepcopy(s))
         except  Exception as e:
             logger.warning("Screen.py read_config error :"+str(e))
 
@@ -181,17 +325,30 @@ class Screen:
         return image
 
     def get_screen(self, x_left, y_top, x_right, y_bot, rgb=True):    # if absolute need to scale??
-        monitor = {
-            "top": self.mon["top"] + y_top,
-            "left": self.mon["left"] + x_left,
-            "width": x_right - x_left,
-            "height": y_bot - y_top,
-            "mon": self.monitor_number,
-        }
-        image = array(self.mss.grab(monitor))
-        # TODO - mss.grab returns the image in BGR format, so no need to convert to RGB2BGR
+        """ Grabs the region (in pixels relative to the monitor) from the screen.
+        Returns a 3 channel RGB image if rgb is True, otherwise the BGRA grab. With mss the BGRA grab wraps
+        the memory of that grab without a copy, with dxcam it is a copy of the region from the frame. In
+        both cases it is not shared with any other grab and may be modified.
+        """
+        image = None
+        if self._dxcam is not None:
+            image = self._dxcam.grab(x_left, y_top, x_right, y_bot)
+
+        if image is None:
+            with self._capture_lock:
+                monitor = self._grab_region
+                monitor["top"] = self._mon_top + y_top
+                monitor["left"] = self._mon_left + x_left
+                monitor["width"] = x_right - x_left
+                monitor["height"] = y_bot - y_top
+                sct_img = self.mss.grab(monitor)
+
+                # mss.grab returns the image in BGRA format. Wrap the raw bytes of the grab, which mss
+                # allocates per grab, instead of copying them into a new array.
+                image = frombuffer(sct_img.raw, dtype=uint8).reshape(sct_img.height, sct_img.width, 4)
+
         if rgb:
-            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            image = bgra_to_rgb(image)
         return image
         
     def get_screen_rect_pct(self, rect):
@@ -201,9 +358,8 @@ class Screen:
         """
         if self.using_screen:
             abs_rect = self.screen_rect_to_abs(rect)
-            image = self.get_screen(abs_rect[0], abs_rect[1], abs_rect[2], abs_rect[3])
-            # TODO delete this line when COLOR_RGB2BGR is removed from get_screen()
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            image = self.get_screen(abs_rect[0], abs_rect[1], abs_rect[2], abs_rect[3], rgb=False)
+            image = bgra_to_bgr(image)
             return image
         else:
             if self._screen_image is None:
@@ -212,6 +368,12 @@ class Screen:
             image = self.crop_image_by_pct(self._screen_image, rect)
             return image
 
+    def _update_rect_scale(self):
+        """ Caches the [W, H, W, H] multiplier used to convert percentage rects to pixels.
+        Call again whenever the screen width or height changes.
+        """
+        self._scale_wh = array([self.screen_width, self.screen_height, self.screen_width, self.screen_height])
+
     def screen_rect_to_abs(self, rect):
         """ Converts and array of real percentage screen values to int absolutes.
         @param rect: A rect array ([L, T, R, B]) in percent (0.0 - 1.0)
@@ -221,13 +383,20 @@ class Screen:
                     int(rect[2] * self.screen_width), int(rect[3] * self.screen_height)]
         return abs_rect
 
+    def screen_rects_to_abs_batch(self, rects):
+        """ Converts many percentage rects to int absolutes in a single pass. For a single rect use
+        screen_rect_to_abs(), which is faster than numpy for one rect.
+        @param rects: An (N, 4) array of rects ([L, T, R, B]) in percent (0.0 - 1.0). A single rect also works.
+        @return: An (N, 4) int32 array of rects ([L, T, R, B]) in pixels
+        """
+        return (asarray(rects, dtype=float) * self._scale_wh).astype(int32)
+
     def get_screen_full(self):
         """ Grabs a full screenshot and returns the image.
         """
         if self.using_screen:
-            image = self.get_screen(0, 0, self.screen_width, self.screen_height)
-            # TODO delete this line when COLOR_RGB2BGR is removed from get_screen()
-            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            image = self.get_screen(0, 0, self.screen_width, self.screen_height, rgb=False)
+            image = bgra_to_bgr(image)
             return image
         else:
             if self._screen_image is None:
@@ -273,4 +442,5 @@ class Screen:
         # Set the screen size to the original image size, not the region size
         self.screen_width = w
         self.screen_height = h
+        self._update_rect_scale()
 
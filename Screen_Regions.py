@@ -121,10 +121,9 @@ class Screen_Regions:
         self.reg['nav_panel']   = {'rect': [0.25, 0.36, 0.60, 0.85], 'width': 1, 'height': 1, 'filterCB': self.equalize, 'filter': None}  
         
         # convert rect from percent of screen into pixel location, calc the width/height of the area
-        for i, key in enumerate(self.reg):
-            xx = self.reg[key]['rect']
-            self.reg[key]['rect'] = [int(xx[0]*screen.screen_width), int(xx[1]*screen.screen_height), 
-                                     int(xx[2]*screen.screen_width), int(xx[3]*screen.screen_height)]
+        abs_rects = screen.screen_rects_to_abs_batch([self.reg[key]['rect'] for key in self.reg]).tolist()
+        for key, abs_rect in zip(self.reg, abs_rects):
+            self.reg[key]['rect'] = abs_rect
             self.reg[key]['width']  = self.reg[key]['rect'][2] - self.reg[key]['rect'][0]
             self.reg[key]['height'] = self.reg[key]['rect'][3] - self.reg[key]['rect'][1]
 